@@ -0,0 +1,223 @@
+"""Prompt building, Gemini access and note generation shared by the Streamlit UI."""
+import streamlit as st
+import atexit
+import os
+import hashlib
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+# Single worker pool for all background work (LLM streams and the connection
+# warm-up). Each stream holds a worker until it finishes, three for a
+# parallel-section note, so it is sized for several concurrent sessions.
+EXECUTOR_WORKERS = 32
+
+@st.cache_resource
+def get_executor():
+    executor = ThreadPoolExecutor(max_workers=EXECUTOR_WORKERS, thread_name_prefix="nn")
+    atexit.register(executor.shutdown, wait=False)
+    return executor
+
+# Initialize Gemini API
+@st.cache_resource
+def initialize_gemini(system_instruction=None):
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        st.error("⚠️ GEMINI_API_KEY not found in environment variables. Please check your .env file.")
+        st.stop()
+    
+    # Imported here so the SDK (gRPC, protobuf) loads once per process, on first use
+    import google.generativeai as genai
+
+    genai.configure(api_key=api_key)
+    model = genai.GenerativeModel('gemini-2.0-flash', system_instruction=system_instruction)
+
+    # Open the connection while the nurse is still typing so the first
+    # Generate click does not pay for DNS, TCP and TLS setup
+    get_executor().submit(warm_up_connection, model.model_name)
+    return model
+
+def warm_up_connection(model_name):
+    """Issue a cheap metadata request to establish the API connection early."""
+    import google.generativeai as genai
+
+    try:
+        genai.get_model(model_name)
+    except Exception:
+        # Best effort only; the real request will surface any error
+        pass
+
+# Static instructions come first so the provider can cache the shared prefix;
+# only the patient-specific inputs from user_turn() vary between requests.
+STATIC_SYSTEM_PROMPT = """
+Role: Expert ICU nurse writing a nursing follow-up note from a doctor's order note and optional nurse's observations, following NANDA-I protocols (https://www.ncbi.nlm.nih.gov/books/NBK591814/).
+
+Sections (markdown bullet points, medical conventions, a blank line between sections):
+1. Patient Status (Overall Assessment): one sentence on mentation (GCS/RASS), pain (BPS/CPOT if non-verbal or intubated, else self-report) and mobility.
+2. Nursing Diagnoses: highlight any acute change in condition.
+3. Follow up on To-do: if the doctor gives a to-do list, correct its spelling and turn each item into at most 3 simple, precise actions. Propose CLABSI/CAUTI/VAP/SSI bundles when invasive lines are indicated; give simple administration steps for any medicine.
+
+Rules:
+- Only include what is relevant to the doctor's orders; prioritise critical parameters, ordered interventions and patient responses.
+- Interpret findings instead of listing them (e.g. "Glucose falling 65 mg/dL/hr - responding to insulin infusion").
+- Combine protocols when conditions overlap (e.g. DKA on mechanical ventilation).
+- No citations and no salutations; start directly with the note.
+"""
+
+USER_TURN_TEMPLATE = """
+Input:
+• Doctor's Order Note: {doctor}
+- Nurse's Observations of the patient condition (optional): {obs}
+"""
+
+TODO_TEMPLATE = """• Doctor's To-do List:
+{todo}
+"""
+
+# A "To-do:" header on its own line (optionally followed by a blank line), then
+# lines that start with a list marker ("-", "•", "*", "1." or "1)")
+TODO_RE = re.compile(
+    r"^[ \t]*to[- \t]?do(?:[ \t]+list)?[ \t]*:?[ \t]*\n(?:[ \t]*\n)?((?:[ \t]*(?:[-•*]|\d+[.)])[ \t]*.*\n?)+)",
+    re.IGNORECASE | re.MULTILINE
+)
+
+def split_todo(doctor_notes):
+    """Split the doctor's notes into (body, todo_block); todo_block is "" if absent."""
+    match = TODO_RE.search(doctor_notes)
+    if not match:
+        return doctor_notes, ""
+    body = doctor_notes[:match.start()] + doctor_notes[match.end():]
+    return body.strip(), match.group(1).strip()
+
+def user_turn(doctor_notes, nursing_observations):
+    """Build the patient-specific part of the prompt that follows the static instructions."""
+    body, todo_block = split_todo(doctor_notes)
+    turn = USER_TURN_TEMPLATE.format(doctor=body, obs=nursing_observations)
+    if todo_block:
+        turn += TODO_TEMPLATE.format(todo=todo_block)
+    return turn
+
+# Memoised for the process: unlike the Streamlit entry script, this module is
+# imported once, so the lru_cache survives reruns
+@lru_cache(maxsize=8)
+def build_prompt(doctor_notes, nursing_observations):
+    """Build the AI prompt text for display and editing."""
+    return STATIC_SYSTEM_PROMPT + user_turn(doctor_notes, nursing_observations)
+
+def split_prompt(prompt):
+    """Split an edited prompt into (system_instruction, contents).
+
+    The static prefix is only sent as a cacheable system instruction when the
+    user left it untouched; otherwise the whole edited prompt is sent as is.
+    """
+    if prompt.startswith(STATIC_SYSTEM_PROMPT):
+        return STATIC_SYSTEM_PROMPT, prompt[len(STATIC_SYSTEM_PROMPT):]
+    return None, prompt
+
+# The note's sections are independent, so with an unedited prompt each one is
+# requested concurrently and the total wait is the slowest section, not the sum
+SECTIONS = (
+    "Patient Status (Overall Assessment)",
+    "Nursing Diagnoses",
+)
+TODO_SECTION = "Follow up on To-do"
+
+SECTION_TEMPLATE = """
+Write only the "{section}" section of the note; the other sections are generated separately.
+"""
+
+def section_turns(doctor_notes, nursing_observations):
+    """Build one user turn per section, all sharing the static instruction prefix.
+
+    The assessment sections leave out the extracted to-do list. The to-do
+    section gets the full input, since lines and medicines named in the body
+    drive its bundles and administration steps, and inline tasks the regex
+    does not pick up must not be lost.
+    """
+    body, _ = split_todo(doctor_notes)
+    turn = USER_TURN_TEMPLATE.format(doctor=body, obs=nursing_observations)
+    turns = [turn + SECTION_TEMPLATE.format(section=section) for section in SECTIONS]
+    turns.append(
+        user_turn(doctor_notes, nursing_observations)
+        + SECTION_TEMPLATE.format(section=TODO_SECTION)
+    )
+    return turns
+
+def generate_nursing_note(prompt, model):
+    """Yield the nursing note text chunk by chunk as the model streams it."""
+    response = model.generate_content(prompt, stream=True)
+    for chunk in response:
+        yield chunk.text
+
+# Background generation: the API call runs on a shared worker pool so a
+# Streamlit rerun (e.g. the nurse editing a field) does not abort it
+def generate_in_background(prompt, model, chunks):
+    """Stream the note on a worker thread, forwarding each chunk to the queue.
+
+    Returns the full note text; a trailing None on the queue marks the end.
+    """
+    parts = []
+    try:
+        for text in generate_nursing_note(prompt, model):
+            parts.append(text)
+            chunks.put(text)
+    finally:
+        chunks.put(None)
+    return "".join(parts)
+
+def start_generation(contents_list, model):
+    """Submit one background stream per contents; returns (queue, future) pairs."""
+    jobs = []
+    for contents in contents_list:
+        chunks = queue.Queue()
+        jobs.append((chunks, get_executor().submit(generate_in_background, contents, model, chunks)))
+    return jobs
+
+BLANK_LINES_RE = re.compile(r"\n{3,}")
+
+def tidy_markdown(text):
+    """Trim surrounding whitespace and collapse runs of blank lines."""
+    return BLANK_LINES_RE.sub("\n\n", text.strip())
+
+def collect_notes(futures):
+    """Join the finished texts, in submission order, into a single tidied note."""
+    return tidy_markdown("\n\n".join(future.result() for future in futures))
+
+def drain_chunks(chunks):
+    """Yield queued chunks until the worker signals completion."""
+    while (text := chunks.get()) is not None:
+        yield text
+
+# Response cache: identical prompts are answered from memory instead of the
+# API. Kept in-process only, so patient notes are never written to disk.
+CACHE_TTL_SECONDS = 3600
+CACHE_MAX_ENTRIES = 256
+NOTE_CACHE = OrderedDict()
+
+# Reruns of different sessions run on different threads, so guard the cache
+CACHE_LOCK = threading.Lock()
+
+def prompt_cache_key(prompt):
+    """Hash the prompt exactly as written; case can carry clinical meaning (Mg vs mg)."""
+    return hashlib.sha1(prompt.strip().encode("utf-8")).hexdigest()
+
+def lookup_cached_note(prompt):
+    """Return a previously generated note for this prompt, or None."""
+    with CACHE_LOCK:
+        entry = NOTE_CACHE.get(prompt_cache_key(prompt))
+    if entry and time.time() - entry["created"] < CACHE_TTL_SECONDS:
+        return entry["note"]
+    return None
+
+def store_cached_note(prompt, note):
+    """Remember a generated note, evicting the oldest entries past the limit."""
+    with CACHE_LOCK:
+        key = prompt_cache_key(prompt)
+        NOTE_CACHE.pop(key, None)
+        NOTE_CACHE[key] = {"created": time.time(), "note": note}
+        while len(NOTE_CACHE) > CACHE_MAX_ENTRIES:
+            NOTE_CACHE.popitem(last=False)
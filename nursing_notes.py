@@ -1,9 +1,21 @@
 import streamlit as st
-import google.generativeai as genai
-import os
+import string
 from dotenv import load_dotenv
 from datetime import datetime
 
+from core import (
+    STATIC_SYSTEM_PROMPT,
+    build_prompt,
+    collect_notes,
+    drain_chunks,
+    initialize_gemini,
+    lookup_cached_note,
+    section_turns,
+    split_prompt,
+    start_generation,
+    store_cached_note,
+)
+
 # Load environment variables
 load_dotenv()
 
@@ -15,100 +27,92 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Initialize Gemini API
-@st.cache_resource
-def initialize_gemini():
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        st.error("⚠️ GEMINI_API_KEY not found in environment variables. Please check your .env file.")
-        st.stop()
-    
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel('gemini-2.0-flash')
-
-def build_prompt(doctor_notes, nursing_observations):
-    """Build the AI prompt text for display and editing."""
-    return f"""
-Prompt for AI Model: Nursing Follow-Up Note Generation
-
-Role and Goal: You are an expert Intensive Care Unit (ICU) nurse. Your task is to generate a comprehensive nursing follow-up note based on a given doctor's order note and the provided medical protocols. Your note should be insightful, detailed, and directly relevant to the patient's care plan as outlined in the protocols.
-
-Input:
-• Doctor's Order Note: {doctor_notes}
-- Nurse's Observations of the patient condition (optional): {nursing_observations}
-
-Output Format: Generate a nursing follow-up note with the following sections, using bullet points for clarity where appropriate:
-• Patient Status (Overall Assessment):
-    ◦ General appearance and mentation (e.g., awake, alert, agitated, sedated, GCS, RASS scale, any changes).
-    ◦ Pain assessment and current pain level (using BPS/CPOT scale if non-verbal/intubated, or self-report).
-    ◦ Current level of activity and mobility.
-    - Keep the patient status inference to a sentence.
-- Nursing Diagnoses:
-    - If there are any acute changes in the patient's condition, then highlight them in the nursing diagnoses.
-    - Use bullet points, and medical conventions.
-• Follow up on To-do
-    - Doctor's note may end with a to-do list. If yes, your goal is to convert them into simple and actionable items.
-    - At max give 3 actionable items for each of the to-do list items. Keep the language simple and concise. 
-    - All instructions are to be based on NANDA-I (North American Nursing Diagnosis Association International) protocols (https://www.ncbi.nlm.nih.gov/books/NBK591814/)
-    - Be very precise in the instructions.
-    - Use bullet points, and medical conventions.
-    - If there are any indications of invasive lines, propose the relevant infection care bundles - CLABSI, CAUTI, VAP and SSI.
-    - If any medicines are suggested, explain how it can be administered in simple but precise steps.
-    
-Instructions for the AI Model:
-1. Prioritize: Focus on critical parameters, ordered interventions, and patient responses directly relevant to the doctor's orders and the patient's primary diagnoses as implied by the protocols.
-2. Detail & Contextualize: Do not just list data. Explain the significance of the findings (e.g., "Blood glucose decreasing by 65 mg/dL/hr, indicating good response to insulin infusion").
-3. Cross-Reference Protocols: Synthesize information from relevant protocols (e.g., if a DKA patient is also on mechanical ventilation, incorporate elements from both DKA and ARDS/Ventilation protocols).
-4. Citing (Self-Reference): Do not directly cite within the nursing note. However, ensure the content is directly supported by the information within the provided sources.
-5. Be Comprehensive but Concise: Include all pertinent details without unnecessary verbosity. 
-6. Do not include any information that is not relevant or directly related to the doctor's orders.
-7. Standard Protocols: NANDA-I (North American Nursing Diagnosis Association International) to be adhered to, especially for the follow ups.
-8. Format: Give appropriate spacing between the sections. If any doctor's to-list has spelling or formatting errors, then correct them. Use bullet points.
-9. Salutations: Directly jump into the note without any salutations or messaging before AI output.
-10. Markdown: Give output in markdown format
-"""
-
-def generate_nursing_note(prompt, model):
-    try:
-        response = model.generate_content(prompt)
-        return response.text
-    except Exception as e:
-        st.error(f"Error generating nursing notes: {str(e)}")
-        return None
+# Download file layout, filled in only when a note is actually on screen
+DL_TEMPLATE = string.Template("""NURSING NOTES
+Generated on: $ts
+
+DOCTOR'S NOTES:
+$doc
+
+NURSING OBSERVATIONS:
+$obs
+
+NURSING NOTES:
+$notes
+""")
 
 # Initialize session state for prompt
 if "edited_prompt" not in st.session_state:
     st.session_state.edited_prompt = ""
 
-# Live update prompt whenever inputs change
+def current_inputs():
+    """The (doctor_notes, nursing_observations) pair last submitted from the form."""
+    return (st.session_state.doctor_notes, st.session_state.nursing_observations)
+
+# Rebuild the prompt from the current inputs on request rather than per edit
 def update_prompt():
-    st.session_state.edited_prompt = build_prompt(
-        st.session_state.doctor_notes,
-        st.session_state.nursing_observations
-    )
+    st.session_state.edited_prompt = build_prompt(*current_inputs())
+    # Remember what the prompt was built from so a stale prompt can be detected
+    st.session_state.prompt_inputs = current_inputs()
+
+def prompt_is_stale():
+    """True when the inputs changed since the prompt in the review box was built."""
+    return st.session_state.get("prompt_inputs") != current_inputs()
+
+# Runs before Generate: build an empty prompt and keep an untouched one in
+# step with the inputs; only edited, non-empty prompts are left to the stale check
+def sync_prompt():
+    built_from = st.session_state.get("prompt_inputs")
+    prompt = st.session_state.edited_prompt
+    if not prompt.strip():
+        update_prompt()
+    elif prompt_is_stale() and built_from is not None and prompt == build_prompt(*built_from):
+        update_prompt()
 
 def main():
     st.title("🩺 Nurse Note Generator")
     st.markdown("Streamline nursing documentation based on physician orders")
+
+    # Cached resource: built once per process, a dict lookup on later reruns
+    model = initialize_gemini(STATIC_SYSTEM_PROMPT)
+
+    st.sidebar.checkbox(
+        "⚡ Generate sections in parallel",
+        value=True,
+        key="parallel_sections",
+        help="Requests each section of the note concurrently when the prompt is unedited."
+    )
     
     col1, col2 = st.columns([1, 1])
     
     with col1:
-        st.header("📝 Doctor's Notes Input")
-        st.text_area(
-            "Enter the doctor's notes, orders, and treatment plans:",
-            height=200,
-            key="doctor_notes",
-            on_change=update_prompt
-        )
-
-        st.header("📝 Nursing Observations")
-        st.text_area(
-            "Enter your observations of the patient since the doctor's note, if any:",
-            height=200,
-            key="nursing_observations",
-            on_change=update_prompt
-        )
+        # A form batches the inputs: typing triggers no reruns until it is submitted
+        with st.form("notes_form"):
+            st.header("📝 Doctor's Notes Input")
+            st.text_area(
+                "Enter the doctor's notes, orders, and treatment plans:",
+                height=200,
+                key="doctor_notes"
+            )
+
+            st.header("📝 Nursing Observations")
+            st.text_area(
+                "Enter your observations of the patient since the doctor's note, if any:",
+                height=200,
+                key="nursing_observations"
+            )
+
+            # Both buttons submit the form, so Generate always sees the text on screen
+            build_col, generate_col = st.columns([1, 1])
+            with build_col:
+                st.form_submit_button("📝 Build Prompt", on_click=update_prompt, use_container_width=True)
+            with generate_col:
+                generate_clicked = st.form_submit_button(
+                    "🔄 Generate Nursing Notes",
+                    type="primary",
+                    on_click=sync_prompt,
+                    use_container_width=True
+                )
 
     with col2:
         st.header("✏️ Review & Edit Prompt")
@@ -118,41 +122,107 @@ def main():
             key="edited_prompt"
         )
 
-        if st.button("🔄 Generate Nursing Notes", type="primary", use_container_width=True):
+        nursing_notes = None
+        if generate_clicked:
             if not st.session_state.doctor_notes.strip():
                 st.warning("⚠️ Please enter doctor's notes to generate nursing documentation.")
+            elif prompt_is_stale():
+                # Only reachable when the prompt was edited; sync_prompt rebuilds untouched ones
+                st.warning(
+                    "⚠️ The notes changed after the prompt was edited. Click Build Prompt "
+                    "to rebuild it for the current notes, then re-apply your edits."
+                )
             else:
                 with st.spinner("Generating comprehensive nursing notes..."):
-                    model = initialize_gemini()
-                    nursing_notes = generate_nursing_note(st.session_state.edited_prompt, model)
-                    
+                    prompt = st.session_state.edited_prompt
+                    # The download pairs the note with the inputs it was generated from
+                    st.session_state.note_inputs = st.session_state.prompt_inputs
+                    nursing_notes = lookup_cached_note(prompt)
                     if nursing_notes:
+                        # Save state before any st.* call: a widget interaction raises
+                        # a rerun at the next render call, which would otherwise lose it
+                        st.session_state.nursing_notes = nursing_notes
                         st.markdown("### 📋 Generated Nursing Notes")
-                        st.markdown(nursing_notes, unsafe_allow_html=True)  # Rendered nicely
-                        st.markdown("#### 🗒 Raw Markdown Output")
-                        st.code(nursing_notes, language="markdown")  # Exact formatting preserved
-
-                        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-                        filename = f"nursing_notes_{timestamp}.txt"
-                        download_content = f"""NURSING NOTES
-Generated on: {datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
-
-DOCTOR'S NOTES:
-{st.session_state.doctor_notes}
-
-NURSING OBSERVATIONS:
-{st.session_state.nursing_observations}
-
-NURSING NOTES:
-{nursing_notes}
-"""
-                        st.download_button(
-                            label="📥 Download Nursing Notes",
-                            data=download_content,
-                            file_name=filename,
-                            mime="text/plain",
-                            use_container_width=True
-                        )
+                        st.markdown(nursing_notes)
+                        st.caption("(cached)")
+                    else:
+                        system_instruction, contents = split_prompt(prompt)
+                        contents_list = [contents]
+                        if system_instruction is None:
+                            model = initialize_gemini()
+                        elif st.session_state.parallel_sections and prompt == build_prompt(*current_inputs()):
+                            contents_list = section_turns(*current_inputs())
+                        jobs = start_generation(contents_list, model)
+                        futures = [future for _, future in jobs]
+                        st.session_state.generation = (prompt, futures)
+                        error = None
+                        try:
+                            st.markdown("### 📋 Generated Nursing Notes")
+                            # Render tokens as they arrive; later sections are
+                            # already buffered by the time earlier ones finish
+                            for chunks, _ in jobs:
+                                st.write_stream(drain_chunks(chunks))
+                            nursing_notes = collect_notes(futures)
+                        except Exception as e:
+                            error = e
+                            nursing_notes = None
+                        # Not in a finally: a rerun must leave the future for the resume branch.
+                        # No st.* calls until the result is saved, for the same reason.
+                        st.session_state.nursing_notes = nursing_notes
+                        del st.session_state.generation
+                        if nursing_notes:
+                            store_cached_note(prompt, nursing_notes)
+                        if error:
+                            st.error(f"Error generating nursing notes: {str(error)}")
+        elif "generation" in st.session_state:
+            # A rerun interrupted the stream; the worker kept going, so pick up its result
+            prompt, futures = st.session_state.generation
+            error = None
+            with st.spinner("Finishing the previous generation..."):
+                try:
+                    nursing_notes = collect_notes(futures)
+                except Exception as e:
+                    error = e
+                    nursing_notes = None
+                # Save before the spinner's exit or any render call can raise a rerun
+                st.session_state.nursing_notes = nursing_notes
+                del st.session_state.generation
+                if nursing_notes:
+                    store_cached_note(prompt, nursing_notes)
+            if error:
+                st.error(f"Error generating nursing notes: {str(error)}")
+            elif nursing_notes:
+                st.markdown("### 📋 Generated Nursing Notes")
+                st.markdown(nursing_notes)
+        elif st.session_state.get("nursing_notes"):
+            # Keep the last note on screen across unrelated reruns
+            nursing_notes = st.session_state.nursing_notes
+            st.markdown("### 📋 Generated Nursing Notes")
+            st.markdown(nursing_notes)
+
+        if nursing_notes:
+            # The raw copy doubles the payload, so only send it when asked for
+            if st.checkbox("🗒 Show raw markdown"):
+                st.code(nursing_notes, language="markdown")  # Exact formatting preserved
+
+            # One clock read so the filename and the header show the same second
+            now = datetime.now()
+            timestamp = now.strftime("%Y%m%d_%H%M%S")
+            filename = f"nursing_notes_{timestamp}.txt"
+            doctor_notes, nursing_observations = st.session_state.note_inputs
+            download_content = DL_TEMPLATE.substitute(
+                ts=now.strftime("%Y-%m-%d %H:%M:%S"),
+                doc=doctor_notes,
+                obs=nursing_observations,
+                notes=nursing_notes
+            )
+            st.download_button(
+                label="📥 Download Nursing Notes",
+                data=download_content,
+                file_name=filename,
+                mime="text/plain",
+                use_container_width=True
+            )
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,51 @@
+from core import SECTIONS, TODO_SECTION, section_turns, split_todo
+
+
+def test_split_todo_extracts_bulleted_and_numbered_items():
+    body, todo = split_todo("Pt with DKA on insulin.\nTo-do:\n- BG q1h\n2) K+ replacement\n")
+    assert body == "Pt with DKA on insulin."
+    assert todo == "- BG q1h\n2) K+ replacement"
+
+
+def test_split_todo_ignores_lines_without_a_list_marker():
+    body, todo = split_todo("To do list:\n- Repeat ABG\n2023 labs pending\n")
+    assert todo == "- Repeat ABG"
+    assert body == "2023 labs pending"
+
+
+def test_split_todo_ignores_to_do_inside_prose():
+    notes = "Nothing to do\n- just observe"
+    assert split_todo(notes) == (notes, "")
+
+
+def test_split_todo_leaves_inline_todo_in_body():
+    notes = "Central line R IJ.\nTo do: check labs tomorrow"
+    assert split_todo(notes) == (notes, "")
+
+
+def test_section_turns_give_todo_section_the_full_context():
+    turns = section_turns("Central line R IJ, insulin infusion.\nTo-do:\n- Change dressing\n", "Alert")
+    assert len(turns) == len(SECTIONS) + 1
+    for turn in turns[:-1]:
+        assert "Change dressing" not in turn
+    assert TODO_SECTION in turns[-1]
+    for text in ("Central line R IJ", "Change dressing", "Alert"):
+        assert text in turns[-1]
+
+
+def test_section_turns_keep_todo_section_without_a_list():
+    turns = section_turns("To do: check labs tomorrow", "")
+    assert TODO_SECTION in turns[-1]
+    assert "check labs tomorrow" in turns[-1]
+
+
+def test_split_todo_allows_blank_line_after_header():
+    body, todo = split_todo("Pt stable.\nTo-do:\n\n- Repeat ABG\n")
+    assert body == "Pt stable."
+    assert todo == "- Repeat ABG"
+
+
+def test_split_todo_allows_marker_without_space():
+    body, todo = split_todo("To-do:\n-a\n-b\n")
+    assert todo == "-a\n-b"
+    assert body == ""